@@ -1,8 +1,9 @@
 from enum import Enum
 
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse)
 
 
 @app.get("/")
@@ -10,11 +11,6 @@ async def root():
     return {"message": "Hello , tuk tuk tuk"}
 
 
-# @app.get("/items/all")
-# async def get_all_items():
-#     return {"items": "all items"}
-
-
 # Query Parameters
 @app.get("/items/all")
 async def get_all_items(page: int = 1, limit: int = 10):
@@ -27,10 +23,13 @@ class ItemType(str, Enum):
     finished = "finished"
 
 
+_ITEM_TYPE_RESPONSES = {t: {"item_type": f"Item Type is :{t.value}"} for t in ItemType}
+
+
 # Path Parameter
 @app.get("/items/type/{type}")
 async def get_item_type(type: ItemType):
-    return {"item_type": f"Item Type is :{type}"}
+    return _ITEM_TYPE_RESPONSES[type]
 
 
 @app.get("/items/{item_id}")
@@ -0,0 +1,126 @@
+import asyncio
+import json
+
+import httpx
+from fastapi.testclient import TestClient
+
+import youtube_transcripts
+
+VIDEO_ID = "dQw4w9WgXcQ"
+
+CAPTIONS = {
+    "playerCaptionsTracklistRenderer": {
+        "captionTracks": [
+            {
+                "baseUrl": "https://www.youtube.com/api/timedtext?v=x&lang=en",
+                "name": {"simpleText": "English"},
+                "languageCode": "en",
+                "kind": "",
+            }
+        ],
+        "translationLanguages": [],
+    }
+}
+WATCH_HTML = (
+    '<html>"playabilityStatus":{},"captions":'
+    + json.dumps(CAPTIONS)
+    + ',"videoDetails":{}</html>'
+)
+TIMEDTEXT_XML = (
+    '<?xml version="1.0"?><transcript>'
+    '<text start="0" dur="1">{text}</text>'
+    "</transcript>"
+)
+CONSENT_HTML = (
+    '<form action="https://consent.youtube.com/s">'
+    '<input type="hidden" name="v" value="cb.20210328-17-p0.en+FX+123"></form>'
+)
+
+
+def test_list_transcripts_follows_consent_redirect():
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        if request.url.host == "consent.youtube.com":
+            return httpx.Response(200, text=CONSENT_HTML)
+        if "CONSENT=YES+cb.20210328-17-p0.en+FX+123" in request.headers.get(
+            "cookie", ""
+        ):
+            return httpx.Response(200, text=WATCH_HTML)
+        return httpx.Response(
+            302, headers={"Location": "https://consent.youtube.com/m?continue=x"}
+        )
+
+    async def run():
+        async with youtube_transcripts.make_http_client(
+            transport=httpx.MockTransport(handler)
+        ) as client:
+            return await youtube_transcripts.list_transcripts(client, VIDEO_ID)
+
+    transcript_list = asyncio.run(run())
+
+    transcript = transcript_list.find_transcript(["en"])
+    assert transcript.language == "English"
+    assert [r.url.host for r in requests] == [
+        "www.youtube.com",
+        "consent.youtube.com",
+        "www.youtube.com",
+    ]
+
+
+def test_iter_segments():
+    body = (
+        b'<?xml version="1.0" encoding="utf-8" ?><transcript>'
+        b'<text start="0.5" dur="2">&lt;i&gt;hello&lt;/i&gt; &amp;#39;w&amp;#39;</text>'
+        b'<text start="3">no duration</text>'
+        b'<text start="4" dur="1"></text>'
+        b"</transcript>"
+    )
+
+    assert list(youtube_transcripts.iter_segments(body)) == [
+        {"text": "hello 'w'", "start": 0.5, "duration": 2.0},
+        {"text": "no duration", "start": 3.0, "duration": 0.0},
+    ]
+
+
+def test_transcript_etag_follows_served_track():
+    tracks = list(CAPTIONS["playerCaptionsTracklistRenderer"]["captionTracks"])
+
+    def handler(request):
+        if request.url.path == "/watch":
+            captions = {"playerCaptionsTracklistRenderer": {"captionTracks": tracks}}
+            html = WATCH_HTML.replace(json.dumps(CAPTIONS), json.dumps(captions))
+            return httpx.Response(200, text=html)
+        text = request.url.params["lang"]
+        return httpx.Response(200, text=TIMEDTEXT_XML.format(text=text))
+
+    url = f"/transcript/?video_id={VIDEO_ID}&language=th"
+    with TestClient(youtube_transcripts.app) as client:
+        youtube_transcripts.app.state.http = youtube_transcripts.make_http_client(
+            transport=httpx.MockTransport(handler)
+        )
+        youtube_transcripts.transcript_cache.clear()
+
+        # No Thai track yet, so the English one is served
+        response = client.get(url)
+        assert response.json()[0]["text"] == "en"
+        fallback_etag = response.headers["ETag"]
+        assert (
+            client.get(url, headers={"If-None-Match": fallback_etag}).status_code == 304
+        )
+
+        # Once Thai is available the old ETag no longer matches
+        tracks.append(
+            {
+                "baseUrl": "https://www.youtube.com/api/timedtext?v=x&lang=th",
+                "name": {"simpleText": "Thai"},
+                "languageCode": "th",
+                "kind": "",
+            }
+        )
+        youtube_transcripts.transcript_cache.clear()
+        response = client.get(url, headers={"If-None-Match": fallback_etag})
+        assert response.status_code == 200
+        assert response.json()[0]["text"] == "th"
+        assert response.headers["ETag"] != fallback_etag
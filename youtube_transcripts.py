@@ -1,21 +1,43 @@
+import asyncio
+import hashlib
+import io
+import json
+import os
+import random
 import re
-import time
-from typing import Any, Dict, List
-
-from fastapi import FastAPI, HTTPException
+import string
+import sys
+from functools import lru_cache
+from html import unescape
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+import httpx
+import orjson
+from cachetools import TTLCache
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from lxml import etree
 from youtube_transcript_api import (
+    FailedToCreateConsentCookie,
+    NoTranscriptAvailable,
     NoTranscriptFound,
+    NotTranslatable,
     TooManyRequests,
+    Transcript,
+    TranscriptList,
     TranscriptsDisabled,
+    TranslationLanguageNotAvailable,
     VideoUnavailable,
-    YouTubeTranscriptApi,
+    YouTubeRequestFailed,
 )
+from youtube_transcript_api._settings import WATCH_URL
 
 app = FastAPI(
     title="YouTube Transcript API",
     description="An API to fetch transcripts from YouTube videos",
     version="1.0.0",
+    default_response_class=ORJSONResponse,
 )
 
 # Enable CORS
@@ -27,81 +49,338 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Cache to store recently fetched transcripts
-transcript_cache = {}
 CACHE_DURATION = 3600  # 1 hour in seconds
+CACHE_SIZE = 1024  # max number of transcripts kept in memory
+LANGUAGE_CACHE_DURATION = 86400  # 24 hours in seconds
+LANGUAGE_CACHE_SIZE = 2048  # max number of language lists kept in memory
+TRANSCRIPT_CACHE_CONTROL = "public, max-age=86400, immutable"
+LANGUAGE_CACHE_CONTROL = f"public, max-age={LANGUAGE_CACHE_DURATION}"
 RETRY_DELAY = 2  # seconds to wait between retries
+HTTP_TIMEOUT = 10.0  # seconds before a YouTube request is abandoned
+BATCH_WINDOW = 0.02  # seconds to collect list requests before fetching them
+BATCH_SIZE = 32  # max list requests handled in one batch
+FETCH_CONCURRENCY = 8  # max concurrent list requests sent to YouTube
+STREAM_CHUNK_SIZE = 256  # transcript segments serialized per streamed chunk
+VIDEO_ID_CACHE_SIZE = 4096  # parsed video IDs remembered between requests
+
+# Characters allowed in a video ID and the pattern to find one inside a URL
+VIDEO_ID_CHARS = frozenset(string.ascii_letters + string.digits + "-_")
+VIDEO_URL_PATTERN = re.compile(r"(?:v=|/)([0-9A-Za-z_-]{11})")
+
+# Formatting tags stripped from transcript text
+HTML_TAG_PATTERN = re.compile(r"<[^>]*>")
+
+# Watch page markers for the EU cookie consent interstitial
+CONSENT_FORM = 'action="https://consent.youtube.com/s"'
+CONSENT_VALUE_PATTERN = re.compile(r'name="v" value="(.*?)"')
+
+# Cache to store recently fetched transcripts with their ETag,
+# keyed by (video_id, language)
+transcript_cache = TTLCache(maxsize=CACHE_SIZE, ttl=CACHE_DURATION)
+# Available languages change rarely, so keep them for longer. Entries are the
+# serialized response body and its ETag.
+language_cache = TTLCache(maxsize=LANGUAGE_CACHE_SIZE, ttl=LANGUAGE_CACHE_DURATION)
+# Fetches currently in progress, so concurrent misses share one upstream call
+inflight_requests: Dict[Any, asyncio.Future] = {}
+# Marks a cache miss, since None could be a cached value
+_MISSING = object()
+
+
+def make_http_client(**kwargs) -> httpx.AsyncClient:
+    """Build the HTTP/2 client used for all YouTube requests."""
+    return httpx.AsyncClient(
+        http2=True,
+        # Like requests, follow redirects such as the EU consent.youtube.com one
+        follow_redirects=True,
+        headers={"Accept-Language": "en-US,en;q=0.9"},
+        limits=httpx.Limits(max_connections=50, max_keepalive_connections=20),
+        timeout=HTTP_TIMEOUT,
+        **kwargs,
+    )
+
+
+@app.on_event("startup")
+async def open_http_client():
+    """Open the shared HTTP client."""
+    app.state.http = make_http_client()
+
+
+async def fetch_youtube(
+    client: httpx.AsyncClient, url: str, video_id: str
+) -> httpx.Response:
+    """GET a YouTube page, raising YouTubeRequestFailed on HTTP errors."""
+    response = await client.get(url)
+    try:
+        response.raise_for_status()
+    except httpx.HTTPStatusError as e:
+        raise YouTubeRequestFailed(video_id, e)
+    return response
+
+
+async def fetch_video_html(client: httpx.AsyncClient, video_id: str) -> str:
+    """Fetch the watch page, accepting the EU consent form if it is shown."""
+    url = WATCH_URL.format(video_id=video_id)
+    html = unescape((await fetch_youtube(client, url, video_id)).text)
+    if CONSENT_FORM not in html:
+        return html
+
+    match = CONSENT_VALUE_PATTERN.search(html)
+    if match is None:
+        raise FailedToCreateConsentCookie(video_id)
+    client.cookies.set("CONSENT", "YES+" + match.group(1), domain=".youtube.com")
+
+    html = unescape((await fetch_youtube(client, url, video_id)).text)
+    if CONSENT_FORM in html:
+        raise FailedToCreateConsentCookie(video_id)
+    return html
+
+
+def extract_captions_json(html: str, video_id: str) -> Dict[str, Any]:
+    """Extract the caption track listing embedded in the watch page."""
+    splitted_html = html.split('"captions":')
+
+    if len(splitted_html) <= 1:
+        if 'class="g-recaptcha"' in html:
+            raise TooManyRequests(video_id)
+        if '"playabilityStatus":' not in html:
+            raise VideoUnavailable(video_id)
+        raise TranscriptsDisabled(video_id)
+
+    captions_json = json.loads(
+        splitted_html[1].split(',"videoDetails')[0].replace("\n", "")
+    ).get("playerCaptionsTracklistRenderer")
+    if captions_json is None:
+        raise TranscriptsDisabled(video_id)
+    if "captionTracks" not in captions_json:
+        raise NoTranscriptAvailable(video_id)
+    return captions_json
+
+
+async def list_transcripts(client: httpx.AsyncClient, video_id: str) -> TranscriptList:
+    """List available transcripts for a video."""
+    html = await fetch_video_html(client, video_id)
+    # Only the metadata of the returned transcripts is used. They get no HTTP
+    # client, so calling their own fetch() fails right away; use
+    # fetch_transcript below instead.
+    return TranscriptList.build(None, video_id, extract_captions_json(html, video_id))
+
+
+async def fetch_transcript(
+    client: httpx.AsyncClient, transcript: Transcript
+) -> List[Dict[str, Any]]:
+    """Download and parse the timed text of a transcript."""
+    response = await fetch_youtube(client, transcript._url, transcript.video_id)
+    return list(iter_segments(response.content))
+
+
+def iter_segments(body: bytes):
+    """Parse timed text XML one <text> element at a time."""
+    context = etree.iterparse(
+        io.BytesIO(body), events=("end",), tag="text", resolve_entities=False
+    )
+    for _, element in context:
+        if element.text is not None:
+            yield {
+                "text": HTML_TAG_PATTERN.sub("", unescape(element.text)),
+                "start": float(element.get("start")),
+                "duration": float(element.get("dur", "0.0")),
+            }
+        # Free parsed elements as we go so memory stays flat
+        element.clear()
+        while element.getprevious() is not None:
+            del element.getparent()[0]
+
+
+async def drain_queue(queue: asyncio.Queue, batch: List, max_items: int):
+    """Move queued items into batch until it holds max_items."""
+    while len(batch) < max_items:
+        batch.append(await queue.get())
+
+
+async def process_batch(batch: List, semaphore: asyncio.Semaphore):
+    """List transcripts once per distinct video and resolve every waiter."""
+    waiters: Dict[str, List[asyncio.Future]] = {}
+    for video_id, future in batch:
+        waiters.setdefault(video_id, []).append(future)
+
+    async def fetch(video_id: str):
+        async with semaphore:
+            return await list_transcripts(app.state.http, video_id)
+
+    video_ids = list(waiters)
+    results = await asyncio.gather(
+        *(fetch(video_id) for video_id in video_ids), return_exceptions=True
+    )
+    for video_id, result in zip(video_ids, results):
+        for future in waiters[video_id]:
+            if future.done():  # Caller went away
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+
+async def batch_worker(queue: asyncio.Queue):
+    """Collect list requests for a short window and fetch them together."""
+    semaphore = asyncio.Semaphore(FETCH_CONCURRENCY)
+    pending_batches = set()
+    try:
+        while True:
+            batch = [await queue.get()]
+            try:
+                await asyncio.wait_for(
+                    drain_queue(queue, batch, BATCH_SIZE), timeout=BATCH_WINDOW
+                )
+            except TimeoutError:
+                pass
+
+            # Process in the background so the next batch can start collecting
+            task = asyncio.create_task(process_batch(batch, semaphore))
+            pending_batches.add(task)
+            task.add_done_callback(pending_batches.discard)
+    finally:
+        for task in pending_batches:
+            task.cancel()
+        await asyncio.gather(*pending_batches, return_exceptions=True)
 
 
+@app.on_event("startup")
+async def start_batch_worker():
+    """Start the background worker that batches transcript list requests."""
+    app.state.batch_queue = asyncio.Queue()
+    app.state.batch_worker = asyncio.create_task(batch_worker(app.state.batch_queue))
+
+
+@app.on_event("shutdown")
+async def stop_batch_worker():
+    """Stop the batching worker and wait for its running batches to end."""
+    app.state.batch_worker.cancel()
+    await asyncio.gather(app.state.batch_worker, return_exceptions=True)
+
+
+# Registered after stop_batch_worker so batches never use a closed client
+@app.on_event("shutdown")
+async def close_http_client():
+    """Release pooled connections on shutdown."""
+    await app.state.http.aclose()
+
+
+async def list_transcripts_batched(video_id: str):
+    """Queue a transcript list request and wait for the batch to resolve it."""
+    future = asyncio.get_running_loop().create_future()
+    app.state.batch_queue.put_nowait((video_id, future))
+    return await future
+
+
+@lru_cache(maxsize=VIDEO_ID_CACHE_SIZE)
 def extract_video_id(video_id: str) -> str:
     """Extract clean video ID from various YouTube URL formats."""
     # If it contains '&t=' (timestamp), remove it
-    if "&t=" in video_id:
-        video_id = video_id.split("&t=")[0]
+    index = video_id.find("&t=")
+    if index != -1:
+        video_id = video_id[:index]
 
-    # If it's a full URL, extract the ID
-    patterns = [
-        r"(?:v=|/)([0-9A-Za-z_-]{11}).*",  # Regular YouTube URLs
-        r"^([0-9A-Za-z_-]{11})$",  # Just the ID
-    ]
+    # Already a bare ID, no need for the regex
+    if len(video_id) == 11 and VIDEO_ID_CHARS.issuperset(video_id):
+        return video_id
 
-    for pattern in patterns:
-        match = re.search(pattern, video_id)
-        if match:
-            return match.group(1)
+    # If it's a full URL, extract the ID
+    match = VIDEO_URL_PATTERN.search(video_id)
+    if match:
+        return match.group(1)
 
     return video_id  # Return as-is if no pattern matches
 
 
+@lru_cache(maxsize=VIDEO_ID_CACHE_SIZE)
 def validate_video_id(video_id: str) -> bool:
     """Validate YouTube video ID format."""
-    pattern = r"^[0-9A-Za-z_-]{11}$"
-    return bool(re.match(pattern, video_id))
-
-
-def get_cached_transcript(video_id: str, language: str) -> List[Dict[str, Any]]:
-    """Get transcript from cache if available and not expired."""
-    cache_key = f"{video_id}_{language}"
-    if cache_key in transcript_cache:
-        cached_data = transcript_cache[cache_key]
-        if time.time() - cached_data["timestamp"] < CACHE_DURATION:
-            return cached_data["transcript"]
-        else:
-            del transcript_cache[cache_key]
-    return None
-
-
-def cache_transcript(video_id: str, language: str, transcript: List[Dict[str, Any]]):
-    """Store transcript in cache."""
-    cache_key = f"{video_id}_{language}"
-    transcript_cache[cache_key] = {
-        "transcript": transcript,
-        "timestamp": time.time(),
-    }
+    return len(video_id) == 11 and VIDEO_ID_CHARS.issuperset(video_id)
+
+
+async def get_or_fetch(cache: TTLCache, key: Any, fetch: Callable[[], Awaitable]):
+    """Return a cached value, sharing one in-flight fetch between callers."""
+    while True:
+        # Single lookup, so an entry expiring in between can't raise KeyError
+        value = cache.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+
+        # Someone is already fetching this key, wait for their result
+        future = inflight_requests.get(key)
+        if future is None:
+            break
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # Only give up if we were cancelled, not the request that owned
+            # the fetch; otherwise look again and fetch it ourselves.
+            if not future.cancelled() or asyncio.current_task().cancelling():
+                raise
+
+    future = asyncio.get_running_loop().create_future()
+    inflight_requests[key] = future
+    try:
+        result = await fetch()
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+    except Exception as e:
+        future.set_exception(e)
+        future.exception()  # Mark as retrieved when nobody else is waiting
+        raise
+    else:
+        cache[key] = result
+        future.set_result(result)
+        return result
+    finally:
+        if inflight_requests.get(key) is future:
+            del inflight_requests[key]
+
+
+def backoff_delay(attempt: int) -> float:
+    """Exponential backoff with jitter so retries don't arrive in lockstep."""
+    return RETRY_DELAY * (2**attempt) * random.uniform(0.8, 1.2)
+
+
+def select_transcript(transcript_list: TranscriptList, language: str) -> Transcript:
+    """Pick the requested language, falling back to English or any transcript."""
+    try:
+        return transcript_list.find_transcript([language])
+    except NoTranscriptFound:
+        pass
+
+    # Fall back to English, then to whatever is available
+    try:
+        transcript = transcript_list.find_transcript(["en"])
+    except NoTranscriptFound:
+        transcript = next(iter(transcript_list), None)
+        if transcript is None:
+            raise
+
+    # Let YouTube translate it into the requested language when possible
+    try:
+        return transcript.translate(language)
+    except (NotTranslatable, TranslationLanguageNotAvailable):
+        return transcript
 
 
-def get_transcript_with_retry(
-    video_id: str, language: str = None, max_retries: int = 3
-):
+async def get_transcript_with_retry(video_id: str, language: str, max_retries: int = 3):
     """Get transcript with retry logic."""
     last_error = None
     for attempt in range(max_retries):
         try:
-            if language:
-                return YouTubeTranscriptApi.get_transcript(
-                    video_id, languages=[language]
-                )
-            else:
-                return YouTubeTranscriptApi.get_transcript(video_id)
+            transcript_list = await list_transcripts_batched(video_id)
+            transcript = select_transcript(transcript_list, language)
+            return await fetch_transcript(app.state.http, transcript)
         except TooManyRequests:
             if attempt < max_retries - 1:
-                time.sleep(RETRY_DELAY * (attempt + 1))  # Exponential backoff
+                await asyncio.sleep(backoff_delay(attempt))
                 continue
             last_error = "Too many requests. Please try again later."
         except NoTranscriptFound:
-            last_error = (
-                f"No transcript found in language: {language if language else 'any'}"
-            )
+            last_error = f"No transcript found in language: {language}"
             break
         except VideoUnavailable:
             last_error = "Video is unavailable. It might be private or doesn't exist."
@@ -112,15 +391,47 @@ def get_transcript_with_retry(
         except Exception as e:
             last_error = str(e)
             if attempt < max_retries - 1:
-                time.sleep(RETRY_DELAY * (attempt + 1))
+                await asyncio.sleep(backoff_delay(attempt))
                 continue
             break
 
     raise Exception(last_error)
 
 
-@app.get("/transcript/", response_model=List[Dict[str, Any]])
-async def get_transcript(video_id: str, language: str = "th"):
+async def get_transcript_entry(
+    video_id: str, language: str
+) -> Tuple[List[Dict[str, Any]], str]:
+    """Fetch a transcript along with the ETag of its content."""
+    transcript = await get_transcript_with_retry(video_id, language)
+    return transcript, make_etag(orjson.dumps(transcript))
+
+
+async def iter_json_array(items: List[Dict[str, Any]]):
+    """Serialize a list as a JSON array, yielding it in chunks."""
+    yield b"["
+    for start in range(0, len(items), STREAM_CHUNK_SIZE):
+        chunk = b",".join(map(orjson.dumps, items[start : start + STREAM_CHUNK_SIZE]))
+        yield b"," + chunk if start else chunk
+    yield b"]"
+
+
+def make_etag(data: bytes) -> str:
+    """Build an ETag by hashing the given bytes."""
+    digest = hashlib.blake2b(data, digest_size=8).hexdigest()
+    return f'"{digest}"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Check whether the client already holds the response with this ETag."""
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    tags = (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+    return etag in tags
+
+
+@app.get("/transcript/")
+async def get_transcript(request: Request, video_id: str, language: str = "th"):
     """
     Get the transcript of a YouTube video.
 
@@ -143,33 +454,20 @@ async def get_transcript(video_id: str, language: str = "th"):
                 detail="Invalid video ID format. Please provide a valid YouTube video ID (11 characters, alphanumeric with - and _)",
             )
 
-        # Check cache first
-        cached_transcript = get_cached_transcript(clean_video_id, language)
-        if cached_transcript:
-            return cached_transcript
+        transcript, etag = await get_or_fetch(
+            transcript_cache,
+            (clean_video_id, language),
+            lambda: get_transcript_entry(clean_video_id, language),
+        )
 
-        try:
-            # Try to get transcript with retries
-            transcript = get_transcript_with_retry(clean_video_id, language)
-            cache_transcript(clean_video_id, language, transcript)
-            return transcript
-        except Exception:
-            # If requested language fails, try English
-            try:
-                transcript = get_transcript_with_retry(clean_video_id, "en")
-                cache_transcript(clean_video_id, language, transcript)
-                return transcript
-            except Exception:
-                # If English fails, try without language specification
-                try:
-                    transcript = get_transcript_with_retry(clean_video_id)
-                    cache_transcript(clean_video_id, language, transcript)
-                    return transcript
-                except Exception as final_error:
-                    raise HTTPException(
-                        status_code=400,
-                        detail=str(final_error),
-                    )
+        # The ETag follows the content, since a fallback track may be
+        # replaced once the requested language becomes available
+        headers = {"Cache-Control": TRANSCRIPT_CACHE_CONTROL, "ETag": etag}
+        if etag_matches(request, etag):
+            return Response(status_code=304, headers=headers)
+        return StreamingResponse(
+            iter_json_array(transcript), media_type="application/json", headers=headers
+        )
 
     except HTTPException:
         raise
@@ -180,8 +478,40 @@ async def get_transcript(video_id: str, language: str = "th"):
         )
 
 
+async def get_languages(video_id: str) -> Dict[str, Any]:
+    """List the manual, generated and translatable languages of a video."""
+    transcript_list = await list_transcripts_batched(video_id)
+
+    manual = transcript_list._manually_created_transcripts.values()
+    generated = transcript_list._generated_transcripts.values()
+
+    languages = {
+        "manual": [{"language": t.language, "code": t.language_code} for t in manual],
+        "generated": [
+            {"language": t.language, "code": t.language_code} for t in generated
+        ],
+        "translatable": [],
+        "video_id": video_id,
+    }
+
+    # Get translatable languages
+    try:
+        first_transcript = next(iter(manual))
+        languages["translatable"] = first_transcript.translation_languages
+    except:
+        pass
+
+    return languages
+
+
+async def get_languages_response(video_id: str) -> Tuple[bytes, str]:
+    """Serialize the language listing once, along with its ETag."""
+    body = orjson.dumps(await get_languages(video_id))
+    return body, make_etag(body)
+
+
 @app.get("/languages/{video_id}")
-async def get_available_languages(video_id: str):
+async def get_available_languages(request: Request, video_id: str):
     """Get available languages for a video."""
     try:
         # Clean up video ID
@@ -195,7 +525,11 @@ async def get_available_languages(video_id: str):
             )
 
         try:
-            transcript_list = YouTubeTranscriptApi.list_transcripts(clean_video_id)
+            body, etag = await get_or_fetch(
+                language_cache,
+                clean_video_id,
+                lambda: get_languages_response(clean_video_id),
+            )
         except VideoUnavailable:
             raise HTTPException(
                 status_code=400,
@@ -212,41 +546,11 @@ async def get_available_languages(video_id: str):
                 detail=f"Could not access video transcripts: {str(e)}",
             )
 
-        languages = {
-            "manual": [],
-            "generated": [],
-            "translatable": [],
-            "video_id": clean_video_id,
-        }
-
-        # Get manually created transcripts
-        for transcript in transcript_list._manually_created_transcripts.values():
-            languages["manual"].append(
-                {
-                    "language": transcript.language,
-                    "code": transcript.language_code,
-                }
-            )
-
-        # Get generated transcripts
-        for transcript in transcript_list._generated_transcripts.values():
-            languages["generated"].append(
-                {
-                    "language": transcript.language,
-                    "code": transcript.language_code,
-                }
-            )
-
-        # Get translatable languages
-        try:
-            first_transcript = next(
-                iter(transcript_list._manually_created_transcripts.values())
-            )
-            languages["translatable"] = first_transcript.translation_languages
-        except:
-            pass
-
-        return languages
+        # The track list can change, so the ETag follows the content
+        headers = {"Cache-Control": LANGUAGE_CACHE_CONTROL, "ETag": etag}
+        if etag_matches(request, etag):
+            return Response(status_code=304, headers=headers)
+        return Response(body, media_type="application/json", headers=headers)
     except HTTPException:
         raise
     except Exception as e:
@@ -272,3 +576,17 @@ async def root():
             "If you get rate limit errors, wait a few minutes and try again",
         ],
     }
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(
+        "youtube_transcripts:app",
+        host="0.0.0.0",
+        port=int(os.environ.get("PORT", "8000")),
+        # uvloop isn't available on Windows, see requirements.txt
+        loop="asyncio" if sys.platform == "win32" else "uvloop",
+        http="httptools",
+        workers=os.cpu_count(),
+    )